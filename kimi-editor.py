@@ -7,9 +7,11 @@ novels, books, manuscripts, and other written content.
 """
 
 import argparse
-import json
+import hashlib
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Any, Dict, List
 
 from dotenv import load_dotenv
@@ -18,9 +20,21 @@ from openai import OpenAI
 # Load environment variables from .env file
 load_dotenv()
 
-from tools.compression import compress_context_impl
+from tools import (
+    compress_context_impl,
+    create_project_impl,
+    list_files_impl,
+    read_file_impl,
+    web_search_impl,
+    write_file_impl,
+)
 from utils import (
+    CompressionScheduler,
+    TokenBudget,
+    cheap_token_estimate,
     estimate_token_count,
+    json_dumps,
+    json_loads,
 )
 
 # Constants
@@ -30,6 +44,13 @@ COMPRESSION_THRESHOLD = 180000  # Trigger compression at 90% of limit
 MODEL_NAME = os.getenv("MOONSHOT_MODEL_NAME", "kimi-k2-thinking")
 BACKUP_INTERVAL = 10  # Save backup summary every N iterations
 
+# Tools that neither mutate project state nor the conversation; when the
+# model issues several in one turn they can run concurrently.
+READ_ONLY_TOOLS = {"web_search", "read_file", "list_files"}
+
+# Worker pool for dispatching read-only tool calls in parallel
+_tool_pool = ThreadPoolExecutor(max_workers=8)
+
 
 def load_context_from_file(file_path: str) -> str:
     """
@@ -111,6 +132,30 @@ Examples:
     return prompt, False
 
 
+# Lightweight stand-ins for the OpenAI SDK message objects, used to
+# reassemble the streamed response. Defined once at module scope with
+# slots, instead of allocating fresh type() classes per tool call.
+@dataclass(slots=True)
+class ReconstructedFunction:
+    name: str = ""
+    arguments: str = ""
+
+
+@dataclass(slots=True)
+class ReconstructedToolCall:
+    id: str = None
+    type: str = "function"
+    function: ReconstructedFunction = None
+
+
+@dataclass(slots=True)
+class ReconstructedMessage:
+    role: str = "assistant"
+    content: str = None
+    reasoning_content: str = None
+    tool_calls: List[ReconstructedToolCall] = None
+
+
 def convert_message_for_api(msg: Any) -> Dict[str, Any]:
     """
     Converts a message object to a dictionary suitable for API calls.
@@ -163,115 +208,114 @@ def convert_message_for_api(msg: Any) -> Dict[str, Any]:
     return msg_dict
 
 
-def get_editor_tool_definitions() -> List[Dict[str, Any]]:
-    """
-    Returns the tool definitions for the editor agent.
-
-    Returns:
-        List of tool definition dictionaries
-    """
-    return [
-        {
-            "type": "function",
-            "function": {
-                "name": "list_files",
-                "description": "Lists all files in the active project folder. Use this to see what files are available to edit.",
-                "parameters": {"type": "object", "properties": {}, "required": []},
-            },
+# Tool definitions are constant, so they are built once at import time
+# instead of being re-allocated on every call.
+_EDITOR_TOOL_DEFINITIONS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "list_files",
+            "description": "Lists all files in the active project folder. Use this to see what files are available to edit.",
+            "parameters": {"type": "object", "properties": {}, "required": []},
         },
-        {
-            "type": "function",
-            "function": {
-                "name": "read_file",
-                "description": "Reads the content of a file from the active project folder. ALWAYS read a file before editing it to see its current content.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "filename": {
-                            "type": "string",
-                            "description": "The name of the file to read",
-                        }
-                    },
-                    "required": ["filename"],
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "read_file",
+            "description": "Reads the content of a file from the active project folder. ALWAYS read a file before editing it to see its current content.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "filename": {
+                        "type": "string",
+                        "description": "The name of the file to read",
+                    }
                 },
+                "required": ["filename"],
             },
         },
-        {
-            "type": "function",
-            "function": {
-                "name": "web_search",
-                "description": "Performs a web search to verify facts, check grammar rules, research style guidelines, or gather reference information for editing decisions.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "The search query"}
-                    },
-                    "required": ["query"],
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "web_search",
+            "description": "Performs a web search to verify facts, check grammar rules, research style guidelines, or gather reference information for editing decisions.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "The search query"}
                 },
+                "required": ["query"],
             },
         },
-        {
-            "type": "function",
-            "function": {
-                "name": "create_project",
-                "description": "Creates a new project folder in the 'output' directory for organizing edited content. Can also be used to set an existing project folder as active.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "project_name": {
-                            "type": "string",
-                            "description": "The name for the project folder (will be sanitized for filesystem compatibility)",
-                        }
-                    },
-                    "required": ["project_name"],
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "create_project",
+            "description": "Creates a new project folder in the 'output' directory for organizing edited content. Can also be used to set an existing project folder as active.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "project_name": {
+                        "type": "string",
+                        "description": "The name for the project folder (will be sanitized for filesystem compatibility)",
+                    }
                 },
+                "required": ["project_name"],
             },
         },
-        {
-            "type": "function",
-            "function": {
-                "name": "write_file",
-                "description": "Writes edited content to a markdown file in the active project folder. For editing existing manuscript files, ALWAYS use 'overwrite' mode to edit them in place. Use 'create' only for new editorial notes and reports. Modes: 'create' (creates new file, fails if exists), 'append' (adds content to end), 'overwrite' (replaces entire file content - USE THIS for editing manuscripts).",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "filename": {
-                            "type": "string",
-                            "description": "The name of the markdown file to write (should end in .md)",
-                        },
-                        "content": {
-                            "type": "string",
-                            "description": "The edited content to write to the file",
-                        },
-                        "mode": {
-                            "type": "string",
-                            "enum": ["create", "append", "overwrite"],
-                            "description": "The write mode: 'create' for new files, 'append' to add to existing, 'overwrite' to replace",
-                        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "write_file",
+            "description": "Writes edited content to a markdown file in the active project folder. For editing existing manuscript files, ALWAYS use 'overwrite' mode to edit them in place. Use 'create' only for new editorial notes and reports. Modes: 'create' (creates new file, fails if exists), 'append' (adds content to end), 'overwrite' (replaces entire file content - USE THIS for editing manuscripts).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "filename": {
+                        "type": "string",
+                        "description": "The name of the markdown file to write (should end in .md)",
+                    },
+                    "content": {
+                        "type": "string",
+                        "description": "The edited content to write to the file",
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": ["create", "append", "overwrite"],
+                        "description": "The write mode: 'create' for new files, 'append' to add to existing, 'overwrite' to replace",
                     },
-                    "required": ["filename", "content", "mode"],
                 },
+                "required": ["filename", "content", "mode"],
             },
         },
-        {
-            "type": "function",
-            "function": {
-                "name": "compress_context",
-                "description": "INTERNAL TOOL - This is automatically called by the system when token limit is approached. You should not call this manually. It compresses the conversation history to save tokens.",
-                "parameters": {"type": "object", "properties": {}, "required": []},
-            },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "compress_context",
+            "description": "INTERNAL TOOL - This is automatically called by the system when token limit is approached. You should not call this manually. It compresses the conversation history to save tokens.",
+            "parameters": {"type": "object", "properties": {}, "required": []},
         },
-    ]
+    },
+]
 
 
-def get_editor_system_prompt() -> str:
+def get_editor_tool_definitions() -> List[Dict[str, Any]]:
     """
-    Returns the system prompt for the editor agent.
+    Returns the tool definitions for the editor agent.
 
     Returns:
-        System prompt string
+        List of tool definition dictionaries
     """
-    return """# Core Identity: Lukas, Your World-class Book Editor
+    return _EDITOR_TOOL_DEFINITIONS
+
+
+# The system prompt is a constant, built once at import time.
+_EDITOR_SYSTEM_PROMPT = """# Core Identity: Lukas, Your World-class Book Editor
 
 You are a world-class book editor specialized in both fiction and non-fiction, and you have more than 50 best-selling titles under your belt.
 
@@ -418,6 +462,32 @@ You have a 64K token context window per response. Use it to produce comprehensiv
 **Remember: You have full creative control.** If the author's original voice, style, or approach isn't working for the target audience or market, change it. Your job is to create a best-seller, not to preserve every original choice. Make bold editorial decisions that serve the book's commercial and artistic success."""
 
 
+def get_editor_system_prompt() -> str:
+    """
+    Returns the system prompt for the editor agent.
+
+    Returns:
+        System prompt string
+    """
+    return _EDITOR_SYSTEM_PROMPT
+
+
+def build_messages(
+    static_prefix: List[Dict[str, Any]], dynamic_tail: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Assembles the conversation as a static prefix plus a dynamic tail.
+
+    Provider-side prompt caching matches on the exact byte prefix of the
+    request, so the static prefix (the system prompt) must stay identical
+    and first on every iteration. All dynamic content - user turns, tool
+    calls and their results, compression summaries - is appended after it
+    and never reordered. compress_context_impl already respects this: it
+    keeps the system message in place and only rewrites the middle.
+    """
+    return static_prefix + dynamic_tail
+
+
 def main():
     """Main agent loop."""
 
@@ -446,34 +516,39 @@ def main():
     # Get user input
     user_prompt, is_recovery = get_user_input()
 
-    # Initialize message history
-    messages = [{"role": "system", "content": get_editor_system_prompt()}]
+    # Initialize message history. The system prompt is a frozen static
+    # prefix so provider-side prompt caching can reuse it across
+    # iterations; everything dynamic is appended after it. The hash is
+    # logged so prefix drift between runs (which would defeat the
+    # provider's prompt cache) is easy to spot in the logs.
+    system_prompt = get_editor_system_prompt()
+    sys_hash = hashlib.blake2b(system_prompt.encode("utf-8")).hexdigest()
+    print(f"✓ System prompt hash: {sys_hash[:16]}")
+    static_prefix = [{"role": "system", "content": system_prompt}]
 
     if is_recovery:
-        messages.append(
+        dynamic_tail = [
             {
                 "role": "user",
                 "content": f"[RECOVERED CONTEXT]\n\n{user_prompt}\n\n[END RECOVERED CONTEXT]\n\nPlease continue the editing work from where we left off.",
             }
-        )
+        ]
         print("🔄 Recovery mode: Continuing from previous context\n")
     else:
-        messages.append({"role": "user", "content": user_prompt})
+        dynamic_tail = [{"role": "user", "content": user_prompt}]
         print(f"\n📝 Editing Task: {user_prompt}\n")
 
+    messages = build_messages(static_prefix, dynamic_tail)
+
+    # Incremental token accounting: messages are encoded once as they are
+    # appended, so the per-iteration budget check is free of network calls
+    # and full-history re-encodes.
+    budget = TokenBudget(MODEL_NAME)
+    budget.recount(messages)
+
     # Get tool definitions and create tool mapping
     tools = get_editor_tool_definitions()
 
-    # Import tool implementations
-    from tools import (
-        compress_context_impl,
-        create_project_impl,
-        list_files_impl,
-        read_file_impl,
-        web_search_impl,
-        write_file_impl,
-    )
-
     # Create tool map for the editor
     tool_map = {
         "create_project": create_project_impl,
@@ -493,42 +568,51 @@ def main():
     print(f"Auto-compression at: {COMPRESSION_THRESHOLD:,} tokens")
     print("=" * 60 + "\n")
 
+    # Compression runs in the background so the loop can keep working
+    # with the current messages while the summary is generated
+    compressor = CompressionScheduler(compress_context_impl)
+
     # Main agent loop
     for iteration in range(1, MAX_ITERATIONS + 1):
         print(f"\n{'─' * 60}")
         print(f"Iteration {iteration}/{MAX_ITERATIONS}")
         print(f"{'─' * 60}")
 
-        # Check token count before making API call
-        try:
-            token_count = estimate_token_count(base_url, api_key, MODEL_NAME, messages)
-            print(
-                f"📊 Current tokens: {token_count:,}/{TOKEN_LIMIT:,} ({token_count / TOKEN_LIMIT * 100:.1f}%)"
-            )
-
-            # Trigger compression if approaching limit
-            if token_count >= COMPRESSION_THRESHOLD:
-                print(f"\n⚠️  Approaching token limit! Compressing context...")
-                compression_result = compress_context_impl(
-                    messages=messages, client=client, model=MODEL_NAME, keep_recent=10
+        # Swap in the result of a finished background compression first
+        compressed = compressor.try_apply(messages)
+        if compressed is not None:
+            messages = compressed
+            budget.recount(messages)
+            print(f"✓ Context compressed in the background")
+
+        # Check token count before making API call. The local budget can
+        # drift from the server's tokenizer, so once the cheap chars/4
+        # heuristic agrees we are anywhere near the limit, escalate to
+        # the exact remote counter; on quiet iterations neither the
+        # network nor tiktoken is touched.
+        token_count = budget.total
+        if cheap_token_estimate(messages) > 0.7 * TOKEN_LIMIT:
+            try:
+                token_count = estimate_token_count(
+                    base_url, api_key, MODEL_NAME, messages
                 )
+                budget.total = token_count
+            except Exception:
+                pass  # Keep the local estimate
+        print(
+            f"📊 Current tokens: {token_count:,}/{TOKEN_LIMIT:,} ({token_count / TOKEN_LIMIT * 100:.1f}%)"
+        )
 
-                if "compressed_messages" in compression_result:
-                    messages = compression_result["compressed_messages"]
-                    print(f"✓ {compression_result['message']}")
-                    print(
-                        f"✓ Estimated tokens saved: ~{compression_result.get('tokens_saved', 0):,}"
-                    )
-
-                    # Recalculate token count
-                    token_count = estimate_token_count(
-                        base_url, api_key, MODEL_NAME, messages
-                    )
-                    print(f"📊 New token count: {token_count:,}/{TOKEN_LIMIT:,}\n")
-
-        except Exception as e:
-            print(f"⚠️  Warning: Could not estimate token count: {e}")
-            token_count = 0
+        # Trigger compression if approaching limit. The loop proceeds
+        # with the uncompressed messages; the threshold leaves enough
+        # headroom for the iterations the summary call takes.
+        if token_count >= COMPRESSION_THRESHOLD:
+            if compressor.maybe_start(
+                messages, client=client, model=MODEL_NAME, keep_recent=10
+            ):
+                print(
+                    f"\n⚠️  Approaching token limit! Compressing context in the background..."
+                )
 
         # Auto-backup every N iterations
         if iteration % BACKUP_INTERVAL == 0:
@@ -673,50 +757,29 @@ def main():
                 print("─" * 60 + "\n")
 
             # Reconstruct the message object from accumulated data
-            class ReconstructedMessage:
-                def __init__(self):
-                    self.role = role or "assistant"
-                    self.content = content_text if content_text else None
-                    self.reasoning_content = (
-                        reasoning_content if reasoning_content else None
+            message = ReconstructedMessage(
+                role=role or "assistant",
+                content=content_text if content_text else None,
+                reasoning_content=reasoning_content if reasoning_content else None,
+                tool_calls=[
+                    ReconstructedToolCall(
+                        id=tc["id"],
+                        function=ReconstructedFunction(
+                            name=tc["function"]["name"],
+                            arguments=tc["function"]["arguments"],
+                        ),
                     )
-                    self.tool_calls = None
-
-                    if tool_calls_data:
-                        # Convert to proper format
-                        from openai.types.chat import ChatCompletionMessageToolCall
-                        from openai.types.chat.chat_completion_message_tool_call import (
-                            Function,
-                        )
-
-                        self.tool_calls = []
-                        for tc in tool_calls_data:
-                            if tc["id"]:  # Only add if we have an ID
-                                tool_call = type(
-                                    "ToolCall",
-                                    (),
-                                    {
-                                        "id": tc["id"],
-                                        "type": "function",
-                                        "function": type(
-                                            "Function",
-                                            (),
-                                            {
-                                                "name": tc["function"]["name"],
-                                                "arguments": tc["function"][
-                                                    "arguments"
-                                                ],
-                                            },
-                                        )(),
-                                    },
-                                )()
-                                self.tool_calls.append(tool_call)
-
-            message = ReconstructedMessage()
+                    for tc in tool_calls_data
+                    if tc["id"]  # Only add if we have an ID
+                ]
+                or None,
+            )
 
             # Convert message to dict and add to history
             # Important: preserve the full message object structure
-            messages.append(convert_message_for_api(message))
+            message_dict = convert_message_for_api(message)
+            messages.append(message_dict)
+            budget.add(message_dict)
 
             # Check if the model called any tools
             if not message.tool_calls:
@@ -727,29 +790,44 @@ def main():
                 print("=" * 60)
                 break
 
-            # Handle tool calls
+            # Handle tool calls. Read-only calls at the start of the batch
+            # are independent and I/O-bound, so they are dispatched to the
+            # worker pool up front and run concurrently; everything from
+            # the first stateful call on runs serially, since later calls
+            # must observe its effects (create_project sets the active
+            # folder the reads resolve, write_file creates what a read
+            # expects to see). Results are collected and appended in the
+            # original call order.
             print(f"\n🔧 Model decided to call {len(message.tool_calls)} tool(s):")
 
+            parsed_calls = []
+            new_tool_messages = []
             for tool_call in message.tool_calls:
-                func_name = tool_call.function.name
-                args_str = tool_call.function.arguments
-
                 try:
-                    args = json.loads(args_str)
-                except json.JSONDecodeError:
+                    args = json_loads(tool_call.function.arguments)
+                except ValueError:
                     args = {}
+                parsed_calls.append((tool_call, tool_call.function.name, args))
+
+            futures = {}
+            for tool_call, func_name, args in parsed_calls:
+                tool_func = tool_map.get(func_name)
+                if tool_func is None:
+                    continue  # Unknown tool; nothing to order around
+                if func_name not in READ_ONLY_TOOLS:
+                    break  # Stateful call: stop pre-dispatching here
+                futures[tool_call.id] = _tool_pool.submit(tool_func, **args)
 
+            for tool_call, func_name, args in parsed_calls:
                 print(f"\n  → {func_name}")
-                print(
-                    f"    Arguments: {json.dumps(args, ensure_ascii=False, indent=6)}"
-                )
+                print(f"    Arguments: {json_dumps(args, indent=True)}")
 
                 # Get the tool implementation
                 tool_func = tool_map.get(func_name)
 
                 if not tool_func:
-                    result = f"Error: Unknown tool '{func_name}'"
-                    print(f"    ✗ {result}")
+                    result_text = f"Error: Unknown tool '{func_name}'"
+                    print(f"    ✗ {result_text}")
                 else:
                     # Special handling for compress_context (needs extra params)
                     if func_name == "compress_context":
@@ -764,24 +842,40 @@ def main():
                         # Update messages with compressed version
                         if "compressed_messages" in result_data:
                             messages = result_data["compressed_messages"]
+                            budget.recount(messages)
+                    elif tool_call.id in futures:
+                        # Read-only call already running on the pool
+                        result = futures[tool_call.id].result()
                     else:
                         # Call the tool with its arguments
                         result = tool_func(**args)
 
+                    # Stringify once - multi-MB results shouldn't be
+                    # materialized twice just for a 200-char preview
+                    result_text = result if isinstance(result, str) else str(result)
+
                     # Print result (truncate if too long)
-                    if len(str(result)) > 200:
-                        print(f"    ✓ {str(result)[:200]}...")
-                    else:
-                        print(f"    ✓ {result}")
+                    preview = (
+                        result_text
+                        if len(result_text) <= 200
+                        else result_text[:200] + "..."
+                    )
+                    print(f"    ✓ {preview}")
 
                 # Add tool result to messages
                 tool_message = {
                     "role": "tool",
                     "tool_call_id": tool_call.id,
                     "name": func_name,
-                    "content": str(result),
+                    "content": result_text,
                 }
                 messages.append(tool_message)
+                new_tool_messages.append(tool_message)
+
+            # Learn exact counts for this turn's tool results in one
+            # parallel batch of single-message tokenizer calls; on any
+            # failure the budget falls back to its local estimate.
+            budget.add_batch(new_tool_messages, base_url=base_url, api_key=api_key)
 
         except KeyboardInterrupt:
             print("\n\n⚠️  Interrupted by user. Saving context...")
@@ -7,23 +7,32 @@ and short story collections based on user prompts.
 """
 
 import argparse
-import json
 import os
 import sys
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
+import httpx
 from dotenv import load_dotenv
 from openai import OpenAI
 
 # Load environment variables from .env file
 load_dotenv()
 
-from tools.compression import compress_context_impl
+from tools.compression import (
+    compress_context_impl,
+    prune_by_goal_relevance,
+    prune_tool_outputs,
+    sliding_window_trim,
+)
 from utils import (
+    TokenAccountedHistory,
     estimate_token_count,
     get_system_prompt,
     get_tool_definitions,
     get_tool_map,
+    json_dumps,
+    json_loads,
 )
 
 # Constants
@@ -33,11 +42,34 @@ COMPRESSION_THRESHOLD = 180000  # Trigger compression at 90% of limit
 MODEL_NAME = os.getenv("MOONSHOT_MODEL_NAME", "kimi-k2-thinking")
 BACKUP_INTERVAL = 10  # Save backup summary every N iterations
 
+# Preformatted template for the tool-call progress line
+_PROGRESS_FMT = "\r💬 Generating arguments... %s characters (~%s words)"
+
+
+def _configure_stdout_buffering() -> None:
+    """
+    Disables per-write flushing on stdout.
+
+    Streaming prints one delta at a time; with line buffering (or
+    flush=True) every delta becomes a write() syscall. Turning both off
+    lets deltas accumulate in the 8KB text buffer, and the stream loop
+    flushes periodically instead.
+    """
+    try:
+        sys.stdout.reconfigure(line_buffering=False, write_through=False)
+    except (AttributeError, ValueError):
+        # Not a regular TextIOWrapper (e.g. replaced stdout); keep defaults
+        pass
+
 
 def load_context_from_file(file_path: str) -> str:
     """
     Loads context from a summary file for recovery.
 
+    The file size is known up front, so the whole file is read with a
+    single pre-sized os.read instead of file.read()'s incremental buffer
+    growth - recovery files can run to megabytes.
+
     Args:
         file_path: Path to the context summary file
 
@@ -45,8 +77,21 @@ def load_context_from_file(file_path: str) -> str:
         Content of the file as string
     """
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, size, os.POSIX_FADV_SEQUENTIAL)
+            chunks = [os.read(fd, size)]
+            # os.read may return short for very large files; drain the rest
+            while sum(len(c) for c in chunks) < size:
+                chunk = os.read(fd, size - sum(len(c) for c in chunks))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            os.close(fd)
+        content = b"".join(chunks).decode("utf-8")
         print(f"✓ Loaded context from: {file_path}\n")
         return content
     except Exception as e:
@@ -61,6 +106,13 @@ def get_user_input() -> tuple[str, bool]:
     Returns:
         Tuple of (prompt/context, is_recovery_mode)
     """
+    # Fast path for the common invocation: a single positional prompt.
+    # Building an ArgumentParser is only needed for --recover, --help and
+    # the interactive no-argument mode.
+    argv = sys.argv
+    if len(argv) == 2 and not argv[1].startswith("-"):
+        return argv[1], False
+
     parser = argparse.ArgumentParser(
         description="Kimi Writing Agent - Create novels, books, and short stories",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -114,61 +166,11 @@ Examples:
     return prompt, False
 
 
-def convert_message_for_api(msg: Any) -> Dict[str, Any]:
-    """
-    Converts a message object to a dictionary suitable for API calls.
-    Preserves reasoning_content if present.
-
-    Args:
-        msg: Message object (can be OpenAI message object or dict)
-
-    Returns:
-        Dictionary representation of the message
-    """
-    if isinstance(msg, dict):
-        return msg
-
-    # Convert OpenAI message object to dict
-    msg_dict = {
-        "role": msg.role,
-    }
-
-    if msg.content:
-        msg_dict["content"] = msg.content
-
-    # Preserve reasoning_content if present
-    if hasattr(msg, "reasoning_content"):
-        reasoning = getattr(msg, "reasoning_content")
-        if reasoning:
-            msg_dict["reasoning_content"] = reasoning
-
-    # Preserve tool calls if present
-    if hasattr(msg, "tool_calls") and msg.tool_calls:
-        msg_dict["tool_calls"] = [
-            {
-                "id": tc.id,
-                "type": "function",
-                "function": {
-                    "name": tc.function.name,
-                    "arguments": tc.function.arguments,
-                },
-            }
-            for tc in msg.tool_calls
-        ]
-
-    # Preserve tool call id for tool response messages
-    if hasattr(msg, "tool_call_id") and msg.tool_call_id:
-        msg_dict["tool_call_id"] = msg.tool_call_id
-
-    if hasattr(msg, "name") and msg.name:
-        msg_dict["name"] = msg.name
-
-    return msg_dict
-
-
 def main():
     """Main agent loop."""
 
+    _configure_stdout_buffering()
+
     # Get API key
     api_key = os.getenv("MOONSHOT_API_KEY")
     if not api_key:
@@ -185,17 +187,25 @@ def main():
         print(f"⚠️  Warning: API key seems too short ({len(api_key)} chars)")
     print(f"✓ Base URL: {base_url}\n")
 
-    # Initialize OpenAI client
+    # Initialize OpenAI client. HTTP/2 lets the streamed deltas share one
+    # multiplexed connection with lower per-frame overhead; it requires the
+    # optional h2 package, so fall back to HTTP/1.1 when that is missing.
+    try:
+        http_client = httpx.Client(http2=True, timeout=httpx.Timeout(300.0))
+    except ImportError:
+        http_client = httpx.Client(timeout=httpx.Timeout(300.0))
+
     client = OpenAI(
         api_key=api_key,
         base_url=base_url,
+        http_client=http_client,
     )
 
     # Get user input
     user_prompt, is_recovery = get_user_input()
 
-    # Initialize message history
-    messages = [{"role": "system", "content": get_system_prompt()}]
+    # Initialize message history (with incremental token accounting)
+    messages = TokenAccountedHistory([{"role": "system", "content": get_system_prompt()}])
 
     if is_recovery:
         messages.append(
@@ -213,6 +223,11 @@ def main():
     tools = get_tool_definitions()
     tool_map = get_tool_map()
 
+    # Backups run on a single background worker so their LLM summarization
+    # latency is hidden behind the next model call.
+    backup_pool = ThreadPoolExecutor(max_workers=1)
+    backup_future = None
+
     print("=" * 60)
     print("Starting Kimi Writing Agent")
     print("=" * 60)
@@ -228,14 +243,58 @@ def main():
         print(f"Iteration {iteration}/{MAX_ITERATIONS}")
         print(f"{'─' * 60}")
 
-        # Check token count before making API call
+        # Check token count before making API call.
+        # The local tokenizer is used on the hot path; the remote estimator
+        # is only consulted periodically to correct drift.
         try:
-            token_count = estimate_token_count(base_url, api_key, MODEL_NAME, messages)
+            if iteration % BACKUP_INTERVAL == 0:
+                token_count = estimate_token_count(
+                    base_url, api_key, MODEL_NAME, messages
+                )
+                # Feed the exact count back so the local counter's drift
+                # is corrected instead of persisting until the next
+                # remote check.
+                messages.calibrate(token_count)
+            else:
+                token_count = messages.tokens()
             print(
                 f"📊 Current tokens: {token_count:,}/{TOKEN_LIMIT:,} ({token_count / TOKEN_LIMIT * 100:.1f}%)"
             )
 
-            # Trigger compression if approaching limit
+            # Approaching the limit: first try cheap verbatim pruning of old
+            # tool outputs, and only summarize if that wasn't enough.
+            if token_count >= COMPRESSION_THRESHOLD:
+                pruned = prune_tool_outputs(messages, keep_recent=10)
+                if pruned:
+                    token_count = messages.recount()
+                    print(
+                        f"✂️  Pruned {pruned} old tool output(s). Tokens now: {token_count:,}"
+                    )
+
+            # Still over: drop old tool outputs with low relevance to the
+            # current goal (one tiny LLM call, no re-summarization).
+            if token_count >= COMPRESSION_THRESHOLD:
+                blanked = prune_by_goal_relevance(
+                    messages, client=client, model=MODEL_NAME, keep_recent=10
+                )
+                if blanked:
+                    token_count = messages.recount()
+                    print(
+                        f"✂️  Dropped {blanked} low-relevance tool output(s). Tokens now: {token_count:,}"
+                    )
+
+            # Still over: keep the system-prompt "attention sink" plus a
+            # recent window and drop the middle entirely.
+            if token_count >= COMPRESSION_THRESHOLD:
+                trimmed = sliding_window_trim(messages, sink_k=3, window=20)
+                if len(trimmed) < len(messages):
+                    messages = TokenAccountedHistory(trimmed)
+                    token_count = messages.recount()
+                    print(
+                        f"🪟 Trimmed history to sink + recent window. Tokens now: {token_count:,}"
+                    )
+
+            # Trigger compression if still approaching limit
             if token_count >= COMPRESSION_THRESHOLD:
                 print(f"\n⚠️  Approaching token limit! Compressing context...")
                 compression_result = compress_context_impl(
@@ -243,42 +302,55 @@ def main():
                 )
 
                 if "compressed_messages" in compression_result:
-                    messages = compression_result["compressed_messages"]
+                    messages = TokenAccountedHistory(
+                        compression_result["compressed_messages"]
+                    )
                     print(f"✓ {compression_result['message']}")
                     print(
                         f"✓ Estimated tokens saved: ~{compression_result.get('tokens_saved', 0):,}"
                     )
 
                     # Recalculate token count
-                    token_count = estimate_token_count(
-                        base_url, api_key, MODEL_NAME, messages
-                    )
+                    token_count = messages.recount()
                     print(f"📊 New token count: {token_count:,}/{TOKEN_LIMIT:,}\n")
 
         except Exception as e:
             print(f"⚠️  Warning: Could not estimate token count: {e}")
             token_count = 0
 
-        # Auto-backup every N iterations
-        if iteration % BACKUP_INTERVAL == 0:
-            print(f"💾 Auto-backup (iteration {iteration})...")
+        # Report the previous background backup, if it finished
+        if backup_future is not None and backup_future.done():
             try:
-                compression_result = compress_context_impl(
-                    messages=messages,
-                    client=client,
-                    model=MODEL_NAME,
-                    keep_recent=len(messages),  # Keep all messages, just save summary
-                )
-                if compression_result.get("summary_file"):
+                backup_result = backup_future.result()
+                if backup_result.get("summary_file"):
                     print(
-                        f"✓ Backup saved: {os.path.basename(compression_result['summary_file'])}\n"
+                        f"✓ Backup saved: {os.path.basename(backup_result['summary_file'])}\n"
                     )
             except Exception as e:
                 print(f"⚠️  Warning: Backup failed: {e}\n")
+            backup_future = None
+
+        # Auto-backup every N iterations. The backup only writes a summary
+        # file and never mutates messages, so it runs in the background on
+        # a snapshot while the next model call proceeds.
+        if iteration % BACKUP_INTERVAL == 0 and backup_future is None:
+            print(f"💾 Auto-backup (iteration {iteration})...")
+            snapshot = list(messages)
+            backup_future = backup_pool.submit(
+                compress_context_impl,
+                messages=snapshot,
+                client=client,
+                model=MODEL_NAME,
+                keep_recent=len(snapshot),  # Keep all messages, just save summary
+            )
 
         # Call the model
         try:
             print("🤖 Calling kimi-k2-thinking model...\n")
+            # With line buffering off, everything printed since the last
+            # stream ended is still sitting in the buffer; push it out
+            # before blocking on the model call.
+            sys.stdout.flush()
 
             stream = client.chat.completions.create(
                 model=MODEL_NAME,
@@ -289,10 +361,13 @@ def main():
                 stream=True,  # Enable streaming
             )
 
-            # Accumulate the streaming response
-            reasoning_content = ""
-            content_text = ""
+            # Accumulate the streaming response.
+            # Deltas are collected in lists and joined once at the end;
+            # += on strings is O(n^2) over a 64K-token response.
+            reasoning_parts: List[str] = []
+            content_parts: List[str] = []
             tool_calls_data = []
+            completed_tool_calls = []  # Slots that received an ID, in order
             role = None
             finish_reason = None
 
@@ -303,30 +378,42 @@ def main():
             last_tool_index = -1
 
             # Process the stream
+            chunk_idx = 0
             for chunk in stream:
+                # Flush the buffered output every 64 chunks instead of on
+                # every delta print
+                chunk_idx += 1
+                if chunk_idx % 64 == 0:
+                    sys.stdout.flush()
+
                 if not chunk.choices:
                     continue
 
                 delta = chunk.choices[0].delta
                 finish_reason = chunk.choices[0].finish_reason
 
-                # Get role if present (first chunk)
-                if hasattr(delta, "role") and delta.role:
-                    role = delta.role
+                # Get role if present (first chunk).
+                # getattr with a default avoids per-chunk hasattr probing,
+                # which is slow because hasattr swallows exceptions.
+                role_delta = getattr(delta, "role", None)
+                if role_delta:
+                    role = role_delta
 
                 # Handle reasoning_content streaming
-                if hasattr(delta, "reasoning_content") and delta.reasoning_content:
+                reasoning_delta = getattr(delta, "reasoning_content", None)
+                if reasoning_delta:
                     if not reasoning_header_printed:
                         print("=" * 60)
                         print(f"🧠 Reasoning (Iteration {iteration})")
                         print("=" * 60)
                         reasoning_header_printed = True
 
-                    print(delta.reasoning_content, end="", flush=True)
-                    reasoning_content += delta.reasoning_content
+                    print(reasoning_delta, end="")
+                    reasoning_parts.append(reasoning_delta)
 
                 # Handle regular content streaming
-                if hasattr(delta, "content") and delta.content:
+                content_delta = getattr(delta, "content", None)
+                if content_delta:
                     # Close reasoning section if it was open
                     if reasoning_header_printed and not content_header_printed:
                         print("\n" + "=" * 60 + "\n")
@@ -336,61 +423,89 @@ def main():
                         print("-" * 60)
                         content_header_printed = True
 
-                    print(delta.content, end="", flush=True)
-                    content_text += delta.content
+                    print(content_delta, end="")
+                    content_parts.append(content_delta)
 
                 # Handle tool_calls
-                if hasattr(delta, "tool_calls") and delta.tool_calls:
-                    for tc_delta in delta.tool_calls:
+                tool_call_deltas = getattr(delta, "tool_calls", None)
+                if tool_call_deltas:
+                    for tc_delta in tool_call_deltas:
                         # Ensure we have enough slots in tool_calls_data
                         while len(tool_calls_data) <= tc_delta.index:
                             tool_calls_data.append(
                                 {
                                     "id": None,
                                     "type": "function",
-                                    "function": {"name": "", "arguments": ""},
+                                    "function": {"name": "", "arguments_parts": []},
                                     "chars_received": 0,
+                                    "last_print": 0,
+                                    "progress_ticks": 0,
                                 }
                             )
 
                         tc = tool_calls_data[tc_delta.index]
+                        fn_delta = getattr(tc_delta, "function", None)
 
                         # Print header when we start receiving a tool call
                         if tc_delta.index != last_tool_index:
                             if reasoning_header_printed or content_header_printed:
                                 print("\n" + "=" * 60 + "\n")
 
-                            if hasattr(tc_delta, "function") and tc_delta.function.name:
-                                print(
-                                    f"🔧 Preparing tool call: {tc_delta.function.name}"
-                                )
+                            if fn_delta and fn_delta.name:
+                                print(f"🔧 Preparing tool call: {fn_delta.name}")
                                 print("─" * 60)
                                 tool_call_header_printed = True
                                 last_tool_index = tc_delta.index
 
                         if tc_delta.id:
+                            if tc["id"] is None:
+                                completed_tool_calls.append(tc)
                             tc["id"] = tc_delta.id
-                        if hasattr(tc_delta, "function"):
-                            if tc_delta.function.name:
-                                tc["function"]["name"] = tc_delta.function.name
-                            if tc_delta.function.arguments:
-                                tc["function"]["arguments"] += (
-                                    tc_delta.function.arguments
+                        if fn_delta:
+                            if fn_delta.name:
+                                tc["function"]["name"] = fn_delta.name
+                            if fn_delta.arguments:
+                                tc["function"]["arguments_parts"].append(
+                                    fn_delta.arguments
                                 )
-                                tc["chars_received"] += len(tc_delta.function.arguments)
-
-                                # Show progress indicator every 500 characters
-                                if (
-                                    tc["chars_received"] % 500 == 0
-                                    or tc["chars_received"] < 100
-                                ):
-                                    # Calculate approximate words (rough estimate: 5 chars per word)
-                                    words = tc["chars_received"] // 5
-                                    print(
-                                        f"\r💬 Generating arguments... {tc['chars_received']:,} characters (~{words:,} words)",
-                                        end="",
-                                        flush=True,
+                                tc["chars_received"] += len(fn_delta.arguments)
+
+                                # Show progress indicator every 500 characters.
+                                # Chunks rarely land exactly on 500-char
+                                # boundaries, so track the count at the last
+                                # print instead of using modulo.
+                                if tc["chars_received"] - tc["last_print"] >= 500:
+                                    tc["last_print"] = tc["chars_received"]
+                                    tc["progress_ticks"] += 1
+                                    chars = tc["chars_received"]
+                                    # Rough estimate: 5 chars per word
+                                    sys.stdout.write(
+                                        _PROGRESS_FMT
+                                        % (f"{chars:,}", f"{chars // 5:,}")
                                     )
+                                    # Flush every 4th tick; the carriage
+                                    # return keeps intermediate lines cheap
+                                    if tc["progress_ticks"] % 4 == 0:
+                                        sys.stdout.flush()
+
+            # Make sure everything streamed so far is on screen
+            sys.stdout.flush()
+
+            # Join the accumulated deltas. Only slots that received an ID
+            # become tool calls, so the filter-and-build is one pass here.
+            reasoning_content = "".join(reasoning_parts)
+            content_text = "".join(content_parts)
+            tool_calls = [
+                {
+                    "id": tc["id"],
+                    "type": "function",
+                    "function": {
+                        "name": tc["function"]["name"],
+                        "arguments": "".join(tc["function"].pop("arguments_parts")),
+                    },
+                }
+                for tc in completed_tool_calls
+            ]
 
             # Print closing for content if it was printed
             if content_header_printed:
@@ -401,54 +516,21 @@ def main():
                 print("\n✓ Tool call complete")
                 print("─" * 60 + "\n")
 
-            # Reconstruct the message object from accumulated data
-            class ReconstructedMessage:
-                def __init__(self):
-                    self.role = role or "assistant"
-                    self.content = content_text if content_text else None
-                    self.reasoning_content = (
-                        reasoning_content if reasoning_content else None
-                    )
-                    self.tool_calls = None
-
-                    if tool_calls_data:
-                        # Convert to proper format
-                        from openai.types.chat import ChatCompletionMessageToolCall
-                        from openai.types.chat.chat_completion_message_tool_call import (
-                            Function,
-                        )
+            # Build the assistant message dict directly from the accumulated
+            # stream data - every field is already known here, so there is
+            # no object-to-dict round-trip before appending to the history.
+            message = {"role": role or "assistant"}
+            if content_text:
+                message["content"] = content_text
+            if reasoning_content:
+                message["reasoning_content"] = reasoning_content
+            if tool_calls:
+                message["tool_calls"] = tool_calls
 
-                        self.tool_calls = []
-                        for tc in tool_calls_data:
-                            if tc["id"]:  # Only add if we have an ID
-                                tool_call = type(
-                                    "ToolCall",
-                                    (),
-                                    {
-                                        "id": tc["id"],
-                                        "type": "function",
-                                        "function": type(
-                                            "Function",
-                                            (),
-                                            {
-                                                "name": tc["function"]["name"],
-                                                "arguments": tc["function"][
-                                                    "arguments"
-                                                ],
-                                            },
-                                        )(),
-                                    },
-                                )()
-                                self.tool_calls.append(tool_call)
-
-            message = ReconstructedMessage()
-
-            # Convert message to dict and add to history
-            # Important: preserve the full message object structure
-            messages.append(convert_message_for_api(message))
+            messages.append(message)
 
             # Check if the model called any tools
-            if not message.tool_calls:
+            if not tool_calls:
                 print("=" * 60)
                 print("✅ TASK COMPLETED")
                 print("=" * 60)
@@ -457,21 +539,19 @@ def main():
                 break
 
             # Handle tool calls
-            print(f"\n🔧 Model decided to call {len(message.tool_calls)} tool(s):")
+            print(f"\n🔧 Model decided to call {len(tool_calls)} tool(s):")
 
-            for tool_call in message.tool_calls:
-                func_name = tool_call.function.name
-                args_str = tool_call.function.arguments
+            for tool_call in tool_calls:
+                func_name = tool_call["function"]["name"]
+                args_str = tool_call["function"]["arguments"]
 
                 try:
-                    args = json.loads(args_str)
-                except json.JSONDecodeError:
+                    args = json_loads(args_str)
+                except ValueError:
                     args = {}
 
                 print(f"\n  → {func_name}")
-                print(
-                    f"    Arguments: {json.dumps(args, ensure_ascii=False, indent=6)}"
-                )
+                print(f"    Arguments: {json_dumps(args, indent=True)}")
 
                 # Get the tool implementation
                 tool_func = tool_map.get(func_name)
@@ -492,7 +572,9 @@ def main():
 
                         # Update messages with compressed version
                         if "compressed_messages" in result_data:
-                            messages = result_data["compressed_messages"]
+                            messages = TokenAccountedHistory(
+                                result_data["compressed_messages"]
+                            )
                     else:
                         # Call the tool with its arguments
                         result = tool_func(**args)
@@ -506,7 +588,7 @@ def main():
                 # Add tool result to messages
                 tool_message = {
                     "role": "tool",
-                    "tool_call_id": tool_call.id,
+                    "tool_call_id": tool_call["id"],
                     "name": func_name,
                     "content": str(result),
                 }
@@ -4,11 +4,294 @@ Context compression tool for managing conversation history.
 
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Any
 from .project import get_active_project_folder
 
 
+# Prompt used when summarizing a block of conversation history
+_SUMMARY_PROMPT = """Please provide a comprehensive summary of the conversation history below. Include:
+1. The main task or goal discussed
+2. Key decisions made
+3. Files created and their purposes
+4. Progress made so far
+5. Any important context for continuing the work
+
+Conversation history to summarize:
+"""
+
+
+def _build_conversation_text(messages_to_compress: List[Any]) -> str:
+    """
+    Renders a list of messages into plain text for the summarization call.
+    """
+    conversation_text = ""
+    for msg in messages_to_compress:
+        role = msg.get("role", "unknown")
+        content = msg.get("content", "")
+
+        # Handle different message types
+        if role == "assistant":
+            # Check for reasoning_content
+            if hasattr(msg, "reasoning_content"):
+                reasoning = getattr(msg, "reasoning_content")
+                if reasoning:
+                    conversation_text += f"\n[Assistant Reasoning]: {reasoning[:500]}...\n"
+
+            # Check for tool calls
+            if hasattr(msg, "tool_calls") and msg.tool_calls:
+                tool_calls_info = []
+                for tc in msg.tool_calls:
+                    func_name = tc.function.name
+                    args = tc.function.arguments
+                    tool_calls_info.append(f"{func_name}({args})")
+                conversation_text += f"\n[Assistant Tool Calls]: {', '.join(tool_calls_info)}\n"
+
+            if content:
+                conversation_text += f"\n[Assistant]: {content}\n"
+
+        elif role == "tool":
+            tool_name = msg.get("name", "unknown_tool")
+            conversation_text += f"\n[Tool Result - {tool_name}]: {content[:200]}...\n"
+
+        elif role == "user":
+            conversation_text += f"\n[User]: {content}\n"
+
+    return conversation_text
+
+
+def _summarize_messages(client, model: str, messages_to_compress: List[Any]) -> str:
+    """
+    Calls the model to summarize a block of messages. Raises on API errors.
+    """
+    summary_response = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that creates comprehensive summaries of conversations."},
+            {"role": "user", "content": _SUMMARY_PROMPT + _build_conversation_text(messages_to_compress)}
+        ],
+        temperature=0.7,
+        max_tokens=4096
+    )
+    return summary_response.choices[0].message.content
+
+
+def _split_into_batches(messages: List[Any], batch_chars: int) -> List[List[Any]]:
+    """
+    Splits messages into consecutive batches of roughly batch_chars
+    characters each (about batch_chars/4 tokens).
+    """
+    batches = [[]]
+    size = 0
+    for msg in messages:
+        msg_len = len(str(msg))
+        if batches[-1] and size + msg_len > batch_chars:
+            batches.append([])
+            size = 0
+        batches[-1].append(msg)
+        size += msg_len
+    return batches
+
+
+def prune_tool_outputs(
+    messages: List[Any],
+    keep_recent: int = 10,
+    keep_head: int = 20,
+    keep_tail: int = 20,
+    min_size: int = 2048,
+) -> int:
+    """
+    Truncates old tool outputs in place, without any LLM call.
+
+    Tool results (file reads, web search dumps) make up the bulk of a long
+    conversation and are rarely needed verbatim once the agent has acted on
+    them. For any tool message older than the last keep_recent messages whose
+    content exceeds min_size characters, the middle lines are dropped and
+    replaced with a marker. The surviving lines are kept verbatim - nothing
+    is rewritten - so this is free of both summarization latency and the
+    risk of hallucinated content.
+
+    Args:
+        messages: The full message history (modified in place)
+        keep_recent: Number of recent messages to leave untouched
+        keep_head: Number of leading lines to keep in pruned outputs
+        keep_tail: Number of trailing lines to keep in pruned outputs
+        min_size: Only prune tool outputs larger than this many characters
+
+    Returns:
+        Number of tool messages that were pruned
+    """
+    pruned = 0
+    candidates = messages[:-keep_recent] if keep_recent else messages
+
+    for msg in candidates:
+        if not isinstance(msg, dict) or msg.get("role") != "tool":
+            continue
+
+        content = msg.get("content")
+        if not isinstance(content, str) or len(content) <= min_size:
+            continue
+
+        lines = content.splitlines()
+        if len(lines) <= keep_head + keep_tail:
+            continue
+
+        dropped = len(lines) - keep_head - keep_tail
+        msg["content"] = "\n".join(
+            lines[:keep_head]
+            + [f"...[{dropped} lines pruned]..."]
+            + lines[-keep_tail:]
+        )
+        pruned += 1
+
+    return pruned
+
+
+def sliding_window_trim(
+    messages: List[Any],
+    sink_k: int = 3,
+    window: int = 20,
+) -> List[Any]:
+    """
+    Trims the history to an "attention sink" prefix plus a recent window.
+
+    Keeps the first sink_k messages (the system prompt and the opening user
+    turns, which anchor the task) and the window most recent messages, and
+    drops the middle outright instead of summarizing it. Deterministic and
+    free of LLM cost; the periodic backup summaries still capture the
+    dropped middle.
+
+    Tool responses at the start of the window whose assistant tool_calls
+    message fell outside it are dropped too, as are assistant messages at
+    the end of the prefix whose tool responses fell into the dropped
+    middle, so the result stays valid for the API.
+
+    Args:
+        messages: The full message history
+        sink_k: Number of leading messages to always keep
+        window: Number of trailing messages to keep
+
+    Returns:
+        A new, trimmed message list
+    """
+    if len(messages) <= sink_k + window:
+        return list(messages)
+
+    head = list(messages[:sink_k])
+    tail = list(messages[-window:])
+
+    # Drop orphaned tool responses at the start of the window
+    while tail and isinstance(tail[0], dict) and tail[0].get("role") == "tool":
+        tail.pop(0)
+
+    # The symmetric guard for the prefix: the first assistant turn is
+    # usually a tool_calls message (create_project) whose responses land
+    # in the dropped middle, and a tool_calls entry with no tool messages
+    # after it is rejected by the API.
+    while head and _unanswered_tool_calls(head):
+        head.pop()
+
+    return head + tail
+
+
+def _unanswered_tool_calls(messages: List[Any]) -> set:
+    """
+    Returns the tool_call ids in a message sequence that have no matching
+    tool response within it.
+    """
+    pending = set()
+    for msg in messages:
+        if not isinstance(msg, dict):
+            continue
+        for tool_call in msg.get("tool_calls") or []:
+            if isinstance(tool_call, dict) and tool_call.get("id"):
+                pending.add(tool_call["id"])
+        if msg.get("role") == "tool":
+            pending.discard(msg.get("tool_call_id"))
+    return pending
+
+
+def prune_by_goal_relevance(
+    messages: List[Any],
+    client,
+    model: str,
+    keep_recent: int = 10,
+) -> int:
+    """
+    Drops the least task-relevant old tool outputs before summarization.
+
+    Makes one tiny LLM call asking for a one-sentence statement of the
+    current goal, scores each old tool output against it by word overlap,
+    and blanks the bottom quartile. The tool messages themselves are kept
+    (with a short marker) so that assistant tool_calls always have their
+    matching tool responses, as the API requires.
+
+    Args:
+        messages: The full message history (modified in place)
+        client: The OpenAI client instance
+        model: The model to use for the goal statement
+        keep_recent: Number of recent messages to leave untouched
+
+    Returns:
+        Number of tool outputs that were blanked
+    """
+    # Collect candidate tool messages older than the recent window
+    candidates = [
+        msg
+        for msg in (messages[:-keep_recent] if keep_recent else messages)
+        if isinstance(msg, dict)
+        and msg.get("role") == "tool"
+        and isinstance(msg.get("content"), str)
+        and len(msg["content"]) > 500
+    ]
+    if len(candidates) < 4:
+        return 0
+
+    # Ask for a one-sentence goal statement based on the recent tail
+    tail_text = ""
+    for msg in messages[-keep_recent:]:
+        if isinstance(msg, dict) and isinstance(msg.get("content"), str):
+            tail_text += f"[{msg.get('role', 'unknown')}]: {msg['content'][:500]}\n"
+
+    try:
+        goal_response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": "State the current writing goal in one sentence, "
+                    "given this recent conversation tail:\n\n" + tail_text,
+                }
+            ],
+            temperature=0.3,
+            max_tokens=80,
+        )
+        goal = goal_response.choices[0].message.content or ""
+    except Exception:
+        return 0
+
+    goal_words = set(goal.lower().split())
+    if not goal_words:
+        return 0
+
+    # Score each candidate by overlap with the goal statement
+    scored = []
+    for msg in candidates:
+        content_words = set(msg["content"].lower().split())
+        score = len(goal_words & content_words) / len(goal_words)
+        scored.append((score, msg))
+
+    # Blank the bottom quartile (lowest relevance first)
+    scored.sort(key=lambda pair: pair[0])
+    to_blank = scored[: len(scored) // 4]
+
+    for _, msg in to_blank:
+        msg["content"] = "[Tool output pruned as low-relevance to the current goal]"
+
+    return len(to_blank)
+
+
 def compress_context_impl(
     messages: List[Any],
     client,
@@ -55,64 +338,23 @@ def compress_context_impl(
         messages_to_compress = messages[:-keep_recent]
         recent_messages = messages[-keep_recent:]
     
-    # Create a detailed prompt for summarization
-    summary_prompt = """Please provide a comprehensive summary of the conversation history below. Include:
-1. The main task or goal discussed
-2. Key decisions made
-3. Files created and their purposes
-4. Progress made so far
-5. Any important context for continuing the work
-
-Conversation history to summarize:
-"""
-    
-    # Build the conversation text
-    conversation_text = ""
-    for msg in messages_to_compress:
-        role = msg.get("role", "unknown")
-        content = msg.get("content", "")
-        
-        # Handle different message types
-        if role == "assistant":
-            # Check for reasoning_content
-            if hasattr(msg, "reasoning_content"):
-                reasoning = getattr(msg, "reasoning_content")
-                if reasoning:
-                    conversation_text += f"\n[Assistant Reasoning]: {reasoning[:500]}...\n"
-            
-            # Check for tool calls
-            if hasattr(msg, "tool_calls") and msg.tool_calls:
-                tool_calls_info = []
-                for tc in msg.tool_calls:
-                    func_name = tc.function.name
-                    args = tc.function.arguments
-                    tool_calls_info.append(f"{func_name}({args})")
-                conversation_text += f"\n[Assistant Tool Calls]: {', '.join(tool_calls_info)}\n"
-            
-            if content:
-                conversation_text += f"\n[Assistant]: {content}\n"
-        
-        elif role == "tool":
-            tool_name = msg.get("name", "unknown_tool")
-            conversation_text += f"\n[Tool Result - {tool_name}]: {content[:200]}...\n"
-        
-        elif role == "user":
-            conversation_text += f"\n[User]: {content}\n"
-    
-    # Call the API to get summary
+    # Call the API to get the summary. Very long histories are split into
+    # ~30K-token batches that are summarized in parallel - the batches are
+    # independent, and this keeps each call within the model's efficient
+    # window instead of pushing a single summarization to its own limit.
     try:
-        summary_response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that creates comprehensive summaries of conversations."},
-                {"role": "user", "content": summary_prompt + conversation_text}
-            ],
-            temperature=0.7,
-            max_tokens=4096
-        )
-        
-        summary = summary_response.choices[0].message.content
-        
+        batches = _split_into_batches(messages_to_compress, batch_chars=120_000)
+        if len(batches) == 1:
+            summary = _summarize_messages(client, model, batches[0])
+        else:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                summaries = list(
+                    pool.map(lambda b: _summarize_messages(client, model, b), batches)
+                )
+            summary = "\n\n".join(
+                f"## Part {i + 1} of {len(batches)}\n\n{s}"
+                for i, s in enumerate(summaries)
+            )
     except Exception as e:
         return {
             "compressed_messages": messages,
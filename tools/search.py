@@ -1,12 +1,90 @@
 """
 Web search tool implementation
 """
+import atexit
+import threading
+from functools import lru_cache
+
 from ddgs import DDGS
 
+# Long-lived DDGS sessions, one per thread. Opening a fresh one per call
+# rebuilds the HTTP session and re-acquires cookies, costing a TCP/TLS
+# handshake every time - but DDGS is not thread-safe, and searches can
+# run concurrently on the editor's tool pool, so the session cannot be a
+# single shared global either. Created sessions are tracked (under a
+# lock) so they can all be closed at interpreter exit.
+_local = threading.local()
+_sessions = []
+_sessions_lock = threading.Lock()
+
+
+def _get_ddgs() -> DDGS:
+    ddgs = getattr(_local, "ddgs", None)
+    if ddgs is None:
+        ddgs = DDGS()
+        _local.ddgs = ddgs
+        with _sessions_lock:
+            _sessions.append(ddgs)
+    return ddgs
+
+
+def _discard_ddgs() -> None:
+    """Closes and forgets the calling thread's session."""
+    ddgs = getattr(_local, "ddgs", None)
+    if ddgs is None:
+        return
+    _local.ddgs = None
+    with _sessions_lock:
+        if ddgs in _sessions:
+            _sessions.remove(ddgs)
+    try:
+        ddgs.__exit__(None, None, None)
+    except Exception:
+        pass
+
+
+def _close_all_sessions() -> None:
+    with _sessions_lock:
+        sessions = list(_sessions)
+        del _sessions[:]
+    for ddgs in sessions:
+        try:
+            ddgs.__exit__(None, None, None)
+        except Exception:
+            pass
+
+
+atexit.register(_close_all_sessions)
+
+
+@lru_cache(maxsize=256)
+def _cached_search(normalized_query: str) -> str:
+    """
+    Runs the actual DuckDuckGo search for a normalized query on the
+    calling thread's session.
+
+    Failures raise and are therefore not cached, so the next attempt
+    retries the network call.
+    """
+    try:
+        results = list(_get_ddgs().text(normalized_query, max_results=5))
+    except Exception:
+        # The long-lived session may have gone stale (dropped keep-alive,
+        # expired cookies). Rebuild this thread's session and retry once
+        # before giving up; other threads' sessions are untouched.
+        _discard_ddgs()
+        results = list(_get_ddgs().text(normalized_query, max_results=5))
+    return "\n".join([f"[{i+1}] \"{r['title']}\"\n{r['body']}\nURL: {r['href']}" for i, r in enumerate(results)])
+
+
 def web_search_impl(query: str) -> str:
     """
     Performs a web search using DuckDuckGo and returns the results.
 
+    Results are cached (LRU, 256 entries) keyed by the normalized query
+    (lowercased, whitespace-collapsed), so re-issued searches - retries,
+    recovered sessions - skip the full network round-trip.
+
     Args:
         query: The search query.
 
@@ -14,8 +92,6 @@ def web_search_impl(query: str) -> str:
         A string containing the search results, formatted for display.
     """
     try:
-        with DDGS() as ddgs:
-            results = [r for r in ddgs.text(query, max_results=5)]
-            return "\n".join([f"[{i+1}] \"{r['title']}\"\n{r['body']}\nURL: {r['href']}" for i, r in enumerate(results)])
+        return _cached_search(" ".join(query.lower().split()))
     except Exception as e:
         raise RuntimeError(f"Web search failed: {e}") from e
@@ -2,58 +2,600 @@
 Utility functions for the Kimi Writing Agent.
 """
 
+import atexit
+import hashlib
 import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Any, Callable, Dict, List
 
 import httpx
 import tiktoken
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib json module works too
+    orjson = None
 
-def _estimate_tokens_with_tiktoken(model: str, messages: List[Dict]) -> int:
+
+def json_loads(data):
     """
-    Estimate token count using tiktoken library as a fallback.
-    This is a simplified version based on the OpenAI cookbook.
+    Parses JSON using orjson when available (several times faster on the
+    large tool-call argument blobs), falling back to stdlib json.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj, indent: bool = False) -> str:
+    """
+    Serializes JSON using orjson when available, falling back to stdlib
+    json. With indent=True the output is pretty-printed (2-space indent).
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+
+# Cached encoding for local token estimation (loaded once, on first use)
+_local_encoding = None
+
+
+def _get_local_encoding():
+    """
+    Returns a cached cl100k_base encoding for local token estimation.
+    Loading the BPE table is expensive, so we only do it once per process.
+    """
+    global _local_encoding
+    if _local_encoding is None:
+        _local_encoding = tiktoken.get_encoding("cl100k_base")
+    return _local_encoding
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    """
+    Returns a cached tiktoken encoding for the given model, falling back
+    to cl100k_base for models tiktoken doesn't know about. Constructing an
+    encoder re-parses the BPE merge table, so it must only happen once per
+    model.
     """
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         print(
             f"Warning: Model '{model}' not found for tiktoken. Using cl100k_base encoding."
         )
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return _get_local_encoding()
+
+
+def _message_encode_parts(message: Dict) -> tuple:
+    """
+    Collects the strings to encode for one message, without encoding them.
+
+    Returns:
+        (parts, overhead) where parts is the list of strings whose token
+        counts make up the message and overhead is the fixed per-message
+        token cost (format tokens plus the extra token for a name key).
+    """
+    parts = []
+    overhead = 4  # A rough estimate for message overhead
+    for key, value in message.items():
+        if not value:
+            continue
+
+        content_to_encode = ""
+        if key == "tool_calls":
+            try:
+                # For tool calls, encode the function name and arguments
+                for tool_call in value:
+                    content_to_encode += tool_call.get("function", {}).get("name", "")
+                    content_to_encode += tool_call.get("function", {}).get(
+                        "arguments", ""
+                    )
+            except Exception:
+                content_to_encode += str(value)  # Fallback
+        else:
+            content_to_encode = str(value)
+
+        parts.append(content_to_encode)
+
+        if key == "name":
+            overhead += 1  # Additional token for the name
+
+    return parts, overhead
+
+
+def _count_message_tokens(encoding, message: Dict) -> int:
+    """
+    Counts the tokens for a single message dictionary, including tool calls.
+    This is a simplified version based on the OpenAI cookbook.
+    """
+    parts, overhead = _message_encode_parts(message)
+    return overhead + sum(len(encoding.encode(part)) for part in parts)
+
+
+# Per-message token counts keyed by (model, content hash). Messages never
+# change once appended (and pruning rewrites their content, changing the
+# hash), so across a session each distinct message is encoded exactly once.
+_msg_token_cache: Dict[tuple, int] = {}
+
+
+def _message_cache_key(model: str, message: Dict) -> tuple:
+    """Returns a stable cache key for a message's token count."""
+    try:
+        serialized = json.dumps(message, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        serialized = str(message)
+    return (model, hashlib.blake2b(serialized.encode("utf-8")).digest())
+
+
+def _count_message_tokens_cached(encoding, model: str, message: Dict) -> int:
+    """Counts tokens for one message, memoized by its content hash."""
+    key = _message_cache_key(model, message)
+    tokens = _msg_token_cache.get(key)
+    if tokens is None:
+        tokens = _count_message_tokens(encoding, message)
+        _msg_token_cache[key] = tokens
+    return tokens
+
+
+def _estimate_tokens_with_tiktoken(model: str, messages: List[Dict]) -> int:
+    """
+    Estimate token count using tiktoken library as a fallback.
+    This is a simplified version based on the OpenAI cookbook.
 
-    num_tokens = 0
+    Per-message results are memoized by content hash, and the cache
+    misses are encoded in a single encode_batch() call, which releases
+    the GIL and runs the BPE in parallel across cores - instead of one
+    Python-level encode() per field per message.
+    """
+    encoding = _get_encoding(model)
+    num_tokens = 3  # A rough estimate for priming the reply
+
+    chunks: List[str] = []
+    pending = []  # (cache key, number of chunks, fixed overhead)
     for message in messages:
-        num_tokens += 4  # A rough estimate for message overhead
-        for key, value in message.items():
-            if not value:
-                continue
+        key = _message_cache_key(model, message)
+        cached = _msg_token_cache.get(key)
+        if cached is not None:
+            num_tokens += cached
+            continue
+        parts, overhead = _message_encode_parts(message)
+        chunks.extend(parts)
+        pending.append((key, len(parts), overhead))
+
+    if chunks:
+        all_ids = encoding.encode_batch(chunks, num_threads=os.cpu_count() or 4)
+        pos = 0
+        for key, n_parts, overhead in pending:
+            tokens = overhead + sum(len(ids) for ids in all_ids[pos : pos + n_parts])
+            pos += n_parts
+            _msg_token_cache[key] = tokens
+            num_tokens += tokens
 
-            content_to_encode = ""
-            if key == "tool_calls":
-                try:
-                    # For tool calls, encode the function name and arguments
-                    for tool_call in value:
-                        content_to_encode += tool_call.get("function", {}).get(
-                            "name", ""
-                        )
-                        content_to_encode += tool_call.get("function", {}).get(
-                            "arguments", ""
-                        )
-                except Exception:
-                    content_to_encode += str(value)  # Fallback
-            else:
-                content_to_encode = str(value)
-
-            num_tokens += len(encoding.encode(content_to_encode))
-
-            if key == "name":
-                num_tokens += 1  # Additional token for the name
+    return num_tokens
 
+
+class TokenBudget:
+    """
+    Incremental token accounting for an agent loop.
+
+    Each message is encoded once, when it is added, so per-iteration
+    budget checks cost nothing beyond the newly appended messages -
+    instead of a network round-trip or a full-history re-encode. After
+    the history has been rewritten (context compression), recount()
+    rebuilds the total from scratch.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.total = 3  # A rough estimate for priming the reply
+
+    def add(self, message: Dict) -> int:
+        """
+        Accounts for a newly appended message.
+
+        Returns:
+            The updated running total
+        """
+        encoding = _get_encoding(self.model)
+        self.total += _count_message_tokens_cached(encoding, self.model, message)
+        return self.total
+
+    def add_batch(self, messages: List[Dict], base_url: str = None, api_key: str = None) -> int:
+        """
+        Accounts for several newly appended messages at once.
+
+        When endpoint credentials are given, exact counts are learned from
+        the remote tokenizer (one small request per message, run in
+        parallel) and cached, so the running total tracks what the server
+        would report while only ever uploading the new messages. Without
+        credentials - or on any failure - the local tiktoken estimate is
+        used instead.
+
+        Returns:
+            The updated running total
+        """
+        messages = [msg for msg in messages if isinstance(msg, dict)]
+        if not messages:
+            return self.total
+        if base_url and api_key:
+            try:
+                self.total += sum(
+                    count_messages_remote(base_url, api_key, self.model, messages)
+                )
+                return self.total
+            except Exception:
+                pass  # Fall back to the local estimate below
+        encoding = _get_encoding(self.model)
+        for message in messages:
+            self.total += _count_message_tokens_cached(encoding, self.model, message)
+        return self.total
+
+    def recount(self, messages: List[Dict]) -> int:
+        """
+        Rebuilds the running total for a rewritten history.
+
+        Returns:
+            The updated running total
+        """
+        encoding = _get_encoding(self.model)
+        self.total = 3 + sum(
+            _count_message_tokens_cached(encoding, self.model, msg)
+            for msg in messages
+            if isinstance(msg, dict)
+        )
+        return self.total
+
+
+class TokenAccountedHistory(list):
+    """
+    A message list that keeps an incremental token count.
+
+    Chat history is append-only between compressions, so re-encoding the
+    full list on every check is wasted work. This subclass tracks how far
+    it has counted and only encodes messages appended since the last call
+    to tokens(), turning per-iteration accounting from O(history) into
+    O(new messages) amortized.
+    """
+
+    def __init__(self, messages: List[Dict] = None):
+        super().__init__(messages or [])
+        self._tok_total = 0
+        self._counted_upto = 0
+
+    def tokens(self) -> int:
+        """
+        Returns the estimated token count for the full history, encoding
+        only the messages added since the last call.
+        """
+        encoding = _get_local_encoding()
+        while self._counted_upto < len(self):
+            msg = self[self._counted_upto]
+            if isinstance(msg, dict):
+                self._tok_total += _count_message_tokens(encoding, msg)
+            self._counted_upto += 1
+        return self._tok_total + 3  # A rough estimate for priming the reply
+
+    def recount(self) -> int:
+        """
+        Discards the running total and re-encodes the whole history.
+        Call this after the message list has been rewritten (e.g. by
+        context compression).
+        """
+        self._tok_total = 0
+        self._counted_upto = 0
+        return self.tokens()
+
+    def calibrate(self, total: int) -> None:
+        """
+        Replaces the running total with an externally measured count for
+        the current history (e.g. the provider's own tokenizer), so the
+        local counter's drift is corrected rather than re-accumulated.
+        """
+        self._tok_total = total - 3  # tokens() adds the priming estimate back
+        self._counted_upto = len(self)
+
+
+class CompressionScheduler:
+    """
+    Runs context compression on a background thread.
+
+    Compression costs an entire LLM round-trip, so running it inline
+    stalls the agent loop. Instead, maybe_start() snapshots the history
+    and kicks off compression once the token total crosses a threshold,
+    while the loop keeps working with the current (uncompressed)
+    messages. try_apply(), called at the top of each iteration, swaps in
+    the compressed history once it is ready, carrying over any messages
+    appended while the summary was being generated.
+    """
+
+    def __init__(self, compress_fn: Callable):
+        self._compress_fn = compress_fn
+        self._thread = None
+        self._snapshot_len = 0
+        self._source = None
+        self._result = None
+        self._lock = threading.Lock()
+
+    def maybe_start(self, messages: List[Dict], **compress_kwargs) -> bool:
+        """
+        Launches a background compression of a snapshot of the history,
+        unless one is already in flight.
+
+        Returns:
+            True if a compression was started
+        """
+        if self._thread is not None:
+            return False
+
+        # Compress a copy - the live list keeps growing while we run.
+        # The source list is remembered so try_apply can tell whether the
+        # history was rewritten out from under the snapshot.
+        snapshot = list(messages)
+        self._snapshot_len = len(snapshot)
+        self._source = messages
+
+        def _run():
+            try:
+                result = self._compress_fn(messages=snapshot, **compress_kwargs)
+            except Exception as e:
+                result = {"error": str(e)}
+            with self._lock:
+                self._result = result
+
+        self._thread = threading.Thread(target=_run, daemon=True)
+        self._thread.start()
+        return True
+
+    def try_apply(self, messages: List[Dict]):
+        """
+        Collects the result of a finished background compression.
+
+        Returns:
+            The new message list (compressed snapshot plus everything
+            appended since the snapshot was taken), or None if no
+            compression has finished - or the attempt failed, in which
+            case the error is logged and a later maybe_start() may retry.
+        """
+        with self._lock:
+            result = self._result
+            if result is None:
+                return None
+            self._result = None
+        self._thread = None
+        source, self._source = self._source, None
+
+        # compress_context_impl reports summarization failure by handing
+        # the original list back with the error text in "message" and no
+        # summary file; treat that (and an exception from the thread) as
+        # a failed attempt rather than a compressed history.
+        if not isinstance(result, dict) or result.get("summary_file") is None:
+            error = "unknown error"
+            if isinstance(result, dict):
+                error = result.get("error") or result.get("message") or error
+            print(f"⚠️  Warning: Background compression failed: {error}")
+            return None
+
+        compressed = result.get("compressed_messages")
+        if not compressed:
+            return None
+
+        # If the live history was rewritten while we ran (e.g. a
+        # model-initiated compress_context call), the snapshot no longer
+        # lines up with it - discard the stale result instead of splicing
+        # a tail from a different list.
+        if messages is not source or len(messages) < self._snapshot_len:
+            return None
+
+        return compressed + messages[self._snapshot_len :]
+
+
+def cheap_token_estimate(messages: List[Dict]) -> int:
+    """
+    A fast chars/4 approximation of the conversation's token count.
+
+    Far rougher than tiktoken, but it only costs a C-level len() per
+    string, so it can run every iteration as a gate: an exact counter is
+    only worth paying for once this says the conversation is anywhere
+    near the limit.
+
+    Args:
+        messages: List of message dictionaries
+
+    Returns:
+        Approximate total token count
+    """
+    total = 0
+    for msg in messages:
+        if not isinstance(msg, dict):
+            continue
+        content = msg.get("content")
+        if content:
+            total += (len(str(content)) + 3) // 4
+        for tool_call in msg.get("tool_calls") or []:
+            if isinstance(tool_call, dict):
+                function = tool_call.get("function", {})
+                total += (
+                    len(function.get("name", ""))
+                    + len(function.get("arguments", ""))
+                    + 3
+                ) // 4
+        total += 4  # A rough estimate for message overhead
+    return total
+
+
+def local_estimate_tokens(messages: List[Dict]) -> int:
+    """
+    Estimate the token count for the given messages locally, without any
+    network round-trip.
+
+    This is cheap enough to run on every iteration of the agent loop; the
+    remote estimator (estimate_token_count) only needs to be called
+    periodically to correct drift.
+
+    Args:
+        messages: List of message dictionaries
+
+    Returns:
+        Estimated total token count
+    """
+    encoding = _get_local_encoding()
+    num_tokens = sum(
+        _count_message_tokens(encoding, msg) for msg in messages if isinstance(msg, dict)
+    )
     num_tokens += 3  # A rough estimate for priming the reply
     return num_tokens
 
 
+# Strings longer than this are not worth uploading just to be counted.
+_BLOB_THRESHOLD = 4096
+
+# Token counts for replaced blobs, keyed by content hash, so a chapter
+# that sits in the history for many iterations is only encoded once.
+_blob_token_cache: Dict[bytes, int] = {}
+
+
+def _blob_tokens(text: str) -> int:
+    """Returns the local token count for a blob, memoized by content hash."""
+    key = hashlib.blake2b(text.encode("utf-8")).digest()
+    tokens = _blob_token_cache.get(key)
+    if tokens is None:
+        tokens = len(_get_local_encoding().encode(text))
+        _blob_token_cache[key] = tokens
+    return tokens
+
+
+def _shrink_blobs(msg: Dict) -> tuple:
+    """
+    Replaces very large strings in a message with short "<BLOB:Ntok>"
+    placeholders for estimation-only uploads. The replaced text's token
+    count is computed locally and reported back so the caller can add it
+    to the endpoint's total. The message dict is modified in place, so
+    callers must pass a copy.
+
+    Returns:
+        (message, saved) where saved is the token count to add back for
+        the replaced text
+    """
+    saved = 0
+
+    content = msg.get("content")
+    if isinstance(content, str) and len(content) > _BLOB_THRESHOLD:
+        tokens = _blob_tokens(content)
+        placeholder = f"<BLOB:{tokens}tok>"
+        msg["content"] = placeholder
+        saved += tokens - _blob_tokens(placeholder)
+
+    tool_calls = msg.get("tool_calls")
+    if tool_calls:
+        new_calls = None
+        for i, tool_call in enumerate(tool_calls):
+            if not isinstance(tool_call, dict):
+                continue
+            arguments = tool_call.get("function", {}).get("arguments")
+            if isinstance(arguments, str) and len(arguments) > _BLOB_THRESHOLD:
+                tokens = _blob_tokens(arguments)
+                placeholder = f"<BLOB:{tokens}tok>"
+                if new_calls is None:
+                    # The tool-call dicts may still belong to the live
+                    # history, so replace copies rather than mutating them.
+                    new_calls = list(tool_calls)
+                function = dict(new_calls[i]["function"], arguments=placeholder)
+                new_calls[i] = dict(new_calls[i], function=function)
+                saved += tokens - _blob_tokens(placeholder)
+        if new_calls is not None:
+            msg["tool_calls"] = new_calls
+
+    return msg, saved
+
+
+# Serializable copies keyed by id(msg). Each entry keeps references to
+# the original message and its content so a reused id() - or a message
+# whose content was rewritten in place by pruning - cannot serve a stale
+# copy.
+_serializable_cache: Dict[int, tuple] = {}
+
+
+def _to_serializable(msg) -> tuple:
+    """
+    Builds the estimation-ready copy of one history entry: serializable
+    fields only, with large blobs already replaced by placeholders.
+
+    Cached by message identity, so across a session each message is
+    copied and blob-scanned once instead of on every endpoint call.
+
+    Returns:
+        (clean message dict, saved blob tokens to add back to the total)
+    """
+    key = id(msg)
+    content = msg.get("content") if isinstance(msg, dict) else None
+    cached = _serializable_cache.get(key)
+    if cached is not None and cached[0] is msg and cached[1] is content:
+        return cached[2], cached[3]
+
+    if hasattr(msg, "model_dump"):
+        # OpenAI SDK message object
+        msg_dict = msg.model_dump()
+    elif isinstance(msg, dict):
+        msg_dict = msg.copy()
+    else:
+        msg_dict = {"role": "assistant", "content": str(msg)}
+
+    # Clean up the message to only include serializable fields
+    clean_msg = {}
+    if "role" in msg_dict:
+        clean_msg["role"] = msg_dict["role"]
+    if "content" in msg_dict and msg_dict["content"]:
+        clean_msg["content"] = msg_dict["content"]
+    if "name" in msg_dict:
+        clean_msg["name"] = msg_dict["name"]
+    if "tool_calls" in msg_dict and msg_dict["tool_calls"]:
+        clean_msg["tool_calls"] = msg_dict["tool_calls"]
+    if "tool_call_id" in msg_dict:
+        clean_msg["tool_call_id"] = msg_dict["tool_call_id"]
+
+    clean_msg, saved = _shrink_blobs(clean_msg)
+    _serializable_cache[key] = (msg, content, clean_msg, saved)
+    return clean_msg, saved
+
+
+# Long-lived HTTP clients keyed by base URL. Reusing one client lets
+# keep-alive and TLS session resumption apply, instead of paying a fresh
+# TCP+TLS handshake on every token-endpoint call.
+_clients: Dict[str, httpx.Client] = {}
+
+
+def _get_client(base_url: str, api_key: str) -> httpx.Client:
+    """Returns a cached httpx client for the given base URL."""
+    client = _clients.get(base_url)
+    if client is None:
+        kwargs = dict(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=4),
+        )
+        try:
+            client = httpx.Client(http2=True, **kwargs)
+        except ImportError:  # The optional h2 package is not installed
+            client = httpx.Client(**kwargs)
+        _clients[base_url] = client
+    return client
+
+
+def _close_all_clients() -> None:
+    for client in _clients.values():
+        client.close()
+
+
+atexit.register(_close_all_clients)
+
+
 def estimate_token_count(
     base_url: str, api_key: str, model: str, messages: List[Dict]
 ) -> int:
@@ -71,138 +613,200 @@ def estimate_token_count(
     Returns:
         Total token count
     """
-    # Convert messages to serializable format (remove non-serializable objects)
+    # Convert messages to serializable format (remove non-serializable
+    # objects). The copies are cached by message identity, so only
+    # messages new since the last call are actually rebuilt. The saved
+    # blob tokens are added back to whatever total we return.
     serializable_messages = []
+    blob_adjustment = 0
     for msg in messages:
-        if hasattr(msg, "model_dump"):
-            # OpenAI SDK message object
-            msg_dict = msg.model_dump()
-        elif isinstance(msg, dict):
-            msg_dict = msg.copy()
-        else:
-            msg_dict = {"role": "assistant", "content": str(msg)}
-
-        # Clean up the message to only include serializable fields
-        clean_msg = {}
-        if "role" in msg_dict:
-            clean_msg["role"] = msg_dict["role"]
-        if "content" in msg_dict and msg_dict["content"]:
-            clean_msg["content"] = msg_dict["content"]
-        if "name" in msg_dict:
-            clean_msg["name"] = msg_dict["name"]
-        if "tool_calls" in msg_dict and msg_dict["tool_calls"]:
-            clean_msg["tool_calls"] = msg_dict["tool_calls"]
-        if "tool_call_id" in msg_dict:
-            clean_msg["tool_call_id"] = msg_dict["tool_call_id"]
-
+        clean_msg, saved = _to_serializable(msg)
         serializable_messages.append(clean_msg)
+        blob_adjustment += saved
+
+    # After compression rewrites the history, entries for the discarded
+    # messages would otherwise pin them in memory forever.
+    if len(_serializable_cache) > 2 * len(messages) + 64:
+        _serializable_cache.clear()
 
     try:
         # Both token estimation and chat use api.moonshot.ai
         token_base_url = base_url
 
-        # Make the API call
-        with httpx.Client(
-            base_url=token_base_url,
-            headers={"Authorization": f"Bearer {api_key}"},
-            timeout=30.0,
-        ) as client:
+        # Make the API call on the shared, connection-pooled client.
+        # Large histories make the request body itself expensive to
+        # build, so encode it with orjson when available instead of
+        # going through httpx's stdlib-json default.
+        client = _get_client(token_base_url, api_key)
+        payload = {"model": model, "messages": serializable_messages}
+        if orjson is not None:
             response = client.post(
                 "/tokenizers/estimate-token-count",
-                json={"model": model, "messages": serializable_messages},
+                content=orjson.dumps(payload),
+                headers={"Content-Type": "application/json"},
             )
-            response.raise_for_status()
-            data = response.json()
-            return data.get("data", {}).get("total_tokens", 0)
+        else:
+            response = client.post("/tokenizers/estimate-token-count", json=payload)
+        response.raise_for_status()
+        data = response.json()
+        return data.get("data", {}).get("total_tokens", 0) + blob_adjustment
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 405 or "openrouter.ai" in base_url:
             print(
                 f"Warning: Token estimation API endpoint not available (or not applicable for {base_url}). Falling back to local tiktoken estimation."
             )
-            return _estimate_tokens_with_tiktoken(model, serializable_messages)
+            return (
+                _estimate_tokens_with_tiktoken(model, serializable_messages)
+                + blob_adjustment
+            )
         else:
             raise e
     except httpx.RequestError:
         print(
             f"Warning: Could not connect to token estimation endpoint. Falling back to local tiktoken estimation."
         )
-        return _estimate_tokens_with_tiktoken(model, serializable_messages)
+        return (
+            _estimate_tokens_with_tiktoken(model, serializable_messages)
+            + blob_adjustment
+        )
 
 
-def get_tool_definitions() -> List[Dict[str, Any]]:
+def count_messages_remote(
+    base_url: str, api_key: str, model: str, messages: List[Dict]
+) -> List[int]:
     """
-    Returns the tool definitions in the format expected by kimi-k2-thinking.
+    Learns exact per-message token counts from the Moonshot tokenizer
+    endpoint.
+
+    Each message is submitted as its own single-message conversation -
+    the calls are independent and I/O-bound, so they run in parallel on
+    a thread pool - and the results are written into the per-message
+    token cache, so later local estimates and recounts agree with what
+    the server would report without ever re-uploading the history.
+
+    Args:
+        base_url: The base URL for the API
+        api_key: The API key for authentication
+        model: The model name
+        messages: List of message dictionaries
 
     Returns:
-        List of tool definition dictionaries
+        Per-message token counts, in the order given
     """
-    return [
-        {
-            "type": "function",
-            "function": {
-                "name": "web_search",
-                "description": "Performs a web search using a search engine to gather information, articles, and data on a specified topic. Use this to conduct research before writing.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "The search query"}
-                    },
-                    "required": ["query"],
+    client = _get_client(base_url, api_key)
+
+    def _count_one(message: Dict) -> int:
+        # Tool results are the largest strings in the system; upload a
+        # blob-shrunk copy and count the replaced text locally, just like
+        # estimate_token_count does.
+        clean_msg, saved = _shrink_blobs(dict(message))
+        payload = {"model": model, "messages": [clean_msg]}
+        if orjson is not None:
+            response = client.post(
+                "/tokenizers/estimate-token-count",
+                content=orjson.dumps(payload),
+                headers={"Content-Type": "application/json"},
+            )
+        else:
+            response = client.post("/tokenizers/estimate-token-count", json=payload)
+        response.raise_for_status()
+        total = response.json().get("data", {}).get("total_tokens", 0)
+        # Subtract the conversation-priming overhead the local estimators
+        # add back when summing per-message counts.
+        return max(total - 3, 0) + saved
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        counts = list(pool.map(_count_one, messages))
+
+    for message, tokens in zip(messages, counts):
+        _msg_token_cache[_message_cache_key(model, message)] = tokens
+    return counts
+
+
+# Tool definitions are constant, so they are built once at import time
+# instead of being re-allocated on every call.
+_TOOL_DEFINITIONS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "web_search",
+            "description": "Performs a web search using a search engine to gather information, articles, and data on a specified topic. Use this to conduct research before writing.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "The search query"}
                 },
+                "required": ["query"],
             },
         },
-        {
-            "type": "function",
-            "function": {
-                "name": "create_project",
-                "description": "Creates a new project folder in the 'output' directory with a sanitized name. This should be called first before writing any files. Only one project can be active at a time.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "project_name": {
-                            "type": "string",
-                            "description": "The name for the project folder (will be sanitized for filesystem compatibility)",
-                        }
-                    },
-                    "required": ["project_name"],
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "create_project",
+            "description": "Creates a new project folder in the 'output' directory with a sanitized name. This should be called first before writing any files. Only one project can be active at a time.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "project_name": {
+                        "type": "string",
+                        "description": "The name for the project folder (will be sanitized for filesystem compatibility)",
+                    }
                 },
+                "required": ["project_name"],
             },
         },
-        {
-            "type": "function",
-            "function": {
-                "name": "write_file",
-                "description": "Writes content to a markdown file in the active project folder. Supports three modes: 'create' (creates new file, fails if exists), 'append' (adds content to end of existing file), 'overwrite' (replaces entire file content).",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "filename": {
-                            "type": "string",
-                            "description": "The name of the markdown file to write (should end in .md)",
-                        },
-                        "content": {
-                            "type": "string",
-                            "description": "The content to write to the file",
-                        },
-                        "mode": {
-                            "type": "string",
-                            "enum": ["create", "append", "overwrite"],
-                            "description": "The write mode: 'create' for new files, 'append' to add to existing, 'overwrite' to replace",
-                        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "write_file",
+            "description": "Writes content to a markdown file in the active project folder. Supports three modes: 'create' (creates new file, fails if exists), 'append' (adds content to end of existing file), 'overwrite' (replaces entire file content).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "filename": {
+                        "type": "string",
+                        "description": "The name of the markdown file to write (should end in .md)",
+                    },
+                    "content": {
+                        "type": "string",
+                        "description": "The content to write to the file",
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": ["create", "append", "overwrite"],
+                        "description": "The write mode: 'create' for new files, 'append' to add to existing, 'overwrite' to replace",
                     },
-                    "required": ["filename", "content", "mode"],
                 },
+                "required": ["filename", "content", "mode"],
             },
         },
-        {
-            "type": "function",
-            "function": {
-                "name": "compress_context",
-                "description": "INTERNAL TOOL - This is automatically called by the system when token limit is approached. You should not call this manually. It compresses the conversation history to save tokens.",
-                "parameters": {"type": "object", "properties": {}, "required": []},
-            },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "compress_context",
+            "description": "INTERNAL TOOL - This is automatically called by the system when token limit is approached. You should not call this manually. It compresses the conversation history to save tokens.",
+            "parameters": {"type": "object", "properties": {}, "required": []},
         },
-    ]
+    },
+]
+
+
+def get_tool_definitions() -> List[Dict[str, Any]]:
+    """
+    Returns the tool definitions in the format expected by kimi-k2-thinking.
+
+    Returns:
+        List of tool definition dictionaries
+    """
+    return _TOOL_DEFINITIONS
+
+
+# Tool map built lazily on first use (the import has to stay deferred to
+# avoid a circular import with the tools package) and reused thereafter.
+_tool_map: Dict[str, Callable] = None
 
 
 def get_tool_map() -> Dict[str, Callable]:
@@ -212,19 +816,22 @@ def get_tool_map() -> Dict[str, Callable]:
     Returns:
         Dictionary mapping tool name strings to callable functions
     """
-    from tools import (
-        compress_context_impl,
-        create_project_impl,
-        web_search_impl,
-        write_file_impl,
-    )
+    global _tool_map
+    if _tool_map is None:
+        from tools import (
+            compress_context_impl,
+            create_project_impl,
+            web_search_impl,
+            write_file_impl,
+        )
 
-    return {
-        "create_project": create_project_impl,
-        "write_file": write_file_impl,
-        "compress_context": compress_context_impl,
-        "web_search": web_search_impl,
-    }
+        _tool_map = {
+            "create_project": create_project_impl,
+            "write_file": write_file_impl,
+            "compress_context": compress_context_impl,
+            "web_search": web_search_impl,
+        }
+    return _tool_map
 
 
 def get_system_prompt() -> str: